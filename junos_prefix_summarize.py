@@ -23,6 +23,14 @@ Key Changes in 1.1:
     - Shows duplicates count
     - Added safety assertion to ensure no IP expansion
 
+Key Changes in 1.2:
+    - Merge rewritten as one pass per prefix length (no rescans per merge)
+    - Prefixes stored as raw (maxlen, net, plen) ints — no ipaddress objects
+    - Optional Numba-compiled IPv4 merge kernel (pure-Python fallback)
+    - Safety assertion opt-in via JUNOS_PREFIX_CHECK=1 (holds by construction)
+    - Streams input and output — peak memory no longer scales with file size
+    - IPv4 and IPv6 kept on separate specialized paths end to end
+
 Usage:
     python3 junos_prefix_summarize.py <input-file>
     python3 junos_prefix_summarize.py <input-file> --dry-run
@@ -32,89 +40,432 @@ Usage:
 """
 import sys
 import re
-import ipaddress
+import socket
+import struct
 import time
 import os
+import bisect
+import functools
+import mmap
+import multiprocessing
 from collections import defaultdict
 
+# Below this many prefix-lists the fork/pickle overhead of a pool costs
+# more than the serial loop.
+PARALLEL_MIN_LISTS = 32
+
+# The no-expansion safety check is opt-in: the merge only ever replaces
+# two present halves by their exact supernet, so the invariant holds by
+# construction. Set JUNOS_PREFIX_CHECK=1 to verify it anyway.
+CHECK_INVARIANTS = bool(os.environ.get("JUNOS_PREFIX_CHECK"))
+
+# Numba is optional: when present the IPv4 merge runs as a compiled kernel,
+# otherwise the pure-Python level merge below is used.
+try:
+    import numpy as np
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None:
+    # Signature pinned so compilation happens at import (cached on disk),
+    # not on the first call. Same level-by-level algorithm as
+    # _merge_levels; input must be sorted by (prefixlen descending,
+    # net ascending).
+    @numba.njit("UniTuple(int64[:], 2)(int64[:], int64[:])", cache=True)
+    def _merge_levels_v4(nets, plens):
+        n = nets.shape[0]
+        out_net = np.empty(n, dtype=np.int64)
+        out_plen = np.empty(n, dtype=np.int64)
+        cur = np.empty(n, dtype=np.int64)
+        promo = np.empty(n, dtype=np.int64)
+        nxt = np.empty(n, dtype=np.int64)
+        w = 0
+        i = 0
+        promo_n = 0
+        promo_plen = -1
+        while i < n or promo_n > 0:
+            if i < n and (promo_n == 0 or plens[i] > promo_plen):
+                level = plens[i]
+            else:
+                level = promo_plen
+            # Gather this level: merge the sorted input slice with the
+            # sorted promoted supernets, dropping duplicates (a promoted
+            # supernet may already be present in the input).
+            take = promo_n if promo_plen == level else 0
+            cur_n = 0
+            j = 0
+            while (i < n and plens[i] == level) or j < take:
+                if (i < n and plens[i] == level
+                        and (j >= take or nets[i] <= promo[j])):
+                    v = nets[i]
+                    if j < take and promo[j] == v:
+                        j += 1
+                    i += 1
+                else:
+                    v = promo[j]
+                    j += 1
+                cur[cur_n] = v
+                cur_n += 1
+            if promo_plen == level:
+                promo_n = 0
+            if level == 0:
+                for k in range(cur_n):
+                    out_net[w] = cur[k]
+                    out_plen[w] = 0
+                    w += 1
+                continue
+            # Sibling-pair scan: adjacent aligned pairs promote to the
+            # next (shorter) level, everything else is final.
+            block = np.int64(1) << (32 - level)
+            new_n = 0
+            k = 0
+            while k < cur_n:
+                if (k + 1 < cur_n and cur[k + 1] == cur[k] + block
+                        and cur[k] & block == 0):
+                    nxt[new_n] = cur[k]
+                    new_n += 1
+                    k += 2
+                else:
+                    out_net[w] = cur[k]
+                    out_plen[w] = level
+                    w += 1
+                    k += 1
+            for k in range(new_n):
+                promo[k] = nxt[k]
+            promo_n = new_n
+            promo_plen = level - 1
+        return out_net[:w], out_plen[:w]
+else:
+    _merge_levels_v4 = None
+
+# Bytes pattern: the scanner works on raw file bytes and only decodes the
+# two matched tokens. This case-insensitive pattern runs both as the
+# primary mmap scan (finditer over the whole buffer) and as the fallback
+# for lines the case-sensitive split fast path of the streaming scanner
+# rejects.
 PREFIX_RE = re.compile(
-    r"^\s*set\s+policy-options\s+prefix-list\s+(\S+)\s+"
-    r"([0-9]{1,3}(?:\.[0-9]{1,3}){3}/\d{1,2}|[0-9a-fA-F:]+/\d{1,3})\s*$",
-    re.IGNORECASE
+    rb"^\s*set\s+policy-options\s+prefix-list\s+(\S+)\s+"
+    rb"([0-9]{1,3}(?:\.[0-9]{1,3}){3}/\d{1,2}|[0-9a-fA-F:]+/\d{1,3})\s*?$",
+    re.IGNORECASE | re.MULTILINE
 )
 
-def parse_prefix_lists(lines):
-    """Return dict: name -> (set(network_objects), duplicate_count)"""
-    pl = defaultdict(set)
-    duplicates = defaultdict(int)
-    seen = defaultdict(set)
+# Shape of a single prefix token, identical to the PREFIX_RE alternatives:
+# the line-scanner fast path must accept no more than the full regex does.
+PREFIX_TOKEN_RE = re.compile(
+    rb"(?:[0-9]{1,3}(?:\.[0-9]{1,3}){3}/\d{1,2}|[0-9a-fA-F:]+/\d{1,3})\Z"
+)
+
+def parse_prefix(prefix_str):
+    """
+    Parse 'a.b.c.d/p' or an IPv6 'addr/p' into a (maxlen, net, plen) triple,
+    where net is the network address as a plain int with host bits cleared
+    (same leniency as ip_network(strict=False)). Raises ValueError on
+    malformed input.
+    """
+    addr, _, plen_str = prefix_str.partition('/')
+    plen = int(plen_str)
+    if ':' in addr:
+        try:
+            packed = socket.inet_pton(socket.AF_INET6, addr)
+        except OSError:
+            raise ValueError(f"invalid IPv6 address: {addr}")
+        net = int.from_bytes(packed, 'big')
+        maxlen = 128
+    else:
+        try:
+            # inet_pton, not inet_aton: aton accepts shorthand ('10/8'),
+            # hex and octal octets, silently reinterpreting tokens the
+            # tool must reject.
+            packed = socket.inet_pton(socket.AF_INET, addr)
+        except OSError:
+            raise ValueError(f"invalid IPv4 address: {addr}")
+        net = struct.unpack('!I', packed)[0]
+        maxlen = 32
+    if plen > maxlen:
+        raise ValueError(f"invalid prefix length: /{plen}")
+    net &= ~((1 << (maxlen - plen)) - 1)
+    return (maxlen, net, plen)
 
-    for ln in lines:
+# The same prefix string tends to recur across (and within) prefix-lists;
+# cache the parsed triple per unique string. Failed parses are not cached.
+parse_prefix_cached = functools.lru_cache(maxsize=None)(parse_prefix)
+
+def extract_prefix_line(ln):
+    """
+    Return (name, prefix_str) for a 'set policy-options prefix-list' line,
+    or None. Operates on raw bytes — no UTF-8 decode of the line. Fast
+    path: cheap startswith reject plus split. Lines that look relevant but
+    don't fit the canonical lowercase shape (mixed case, unusual tokens)
+    fall back to the case-insensitive PREFIX_RE. Only the two matched
+    tokens are decoded.
+    """
+    s = ln.strip()
+    if s[:3].lower() != b"set":
+        return None
+    parts = s.split()
+    if (len(parts) == 5
+            and parts[0] == b"set"
+            and parts[1] == b"policy-options"
+            and parts[2] == b"prefix-list"
+            and PREFIX_TOKEN_RE.match(parts[4])):
+        name, prefix = parts[3], parts[4]
+    else:
         match = PREFIX_RE.match(ln)
-        if match:
-            name, prefix_str = match.groups()
-            try:
-                net = ipaddress.ip_network(prefix_str, strict=False)
-                if net in seen[name]:
-                    duplicates[name] += 1
-                else:
-                    pl[name].add(net)
-                    seen[name].add(net)
-            except ValueError:
-                pass
+        if match is None:
+            return None
+        name, prefix = match.group(1), match.group(2)
+    try:
+        return name.decode('utf-8'), prefix.decode('ascii')
+    except UnicodeDecodeError:
+        return None
+
+def _collect_prefixes(pairs):
+    """
+    Fold an iterable of (name, prefix_str) pairs into
+    dict: name -> (set of IPv4 (net, plen), set of IPv6 (net, plen)),
+    plus duplicate counts. Keeping the families apart from parse time on
+    lets the merge run family-specialized loops and skip IPv6 entirely
+    when the config has none.
+    """
+    pl = defaultdict(lambda: (set(), set()))
+    duplicates = defaultdict(int)
+    seen_str = defaultdict(set)
+
+    for name, prefix_str in pairs:
+        # Cheap string-level dedup first: a repeated line never reaches
+        # the parser. Only strings that parsed cleanly are remembered, so
+        # repeated garbage is still just skipped, not counted.
+        if prefix_str in seen_str[name]:
+            duplicates[name] += 1
+            continue
+        try:
+            maxlen, net, plen = parse_prefix_cached(prefix_str)
+        except ValueError:
+            continue
+        seen_str[name].add(prefix_str)
+        # Insert into the destination set directly and detect duplicates
+        # (distinct strings normalizing to the same network, e.g.
+        # 10.0.0.0/24 and 10.0.0.5/24) from the unchanged length.
+        v4, v6 = pl[name]
+        target = v4 if maxlen == 32 else v6
+        before = len(target)
+        target.add((net, plen))
+        if len(target) == before:
+            duplicates[name] += 1
     return pl, duplicates
 
-def are_adjacent(a, b):
-    """Check if networks a and b are adjacent and same prefixlen."""
-    return (
-        a.prefixlen == b.prefixlen
-        and int(b.network_address) == int(a.network_address) + a.num_addresses
-    )
+def parse_prefix_lists(lines):
+    """
+    Scan an iterable of config lines (bytes). Used for stdin and as the
+    fallback when a file can't be memory-mapped.
+    """
+    pairs = (extract_prefix_line(ln) for ln in lines)
+    return _collect_prefixes(p for p in pairs if p is not None)
+
+def _buffer_matches(buf):
+    for match in PREFIX_RE.finditer(buf):
+        try:
+            yield match.group(1).decode('utf-8'), match.group(2).decode('ascii')
+        except UnicodeDecodeError:
+            continue
 
-def exact_merge(networks_set):
+def parse_prefix_buffer(buf):
     """
-    Efficient exact merge of adjacent subnets of the same size.
-    Groups networks by prefix length and merges upward.
-    Works for IPv4 and IPv6.
+    Scan a whole bytes-like buffer (typically an mmap of the input file)
+    with a single finditer pass — no per-line bytes objects at all.
     """
-    nets = set(networks_set)
-    max_prefixlen = max(n.prefixlen for n in nets) if nets else 0
+    return _collect_prefixes(_buffer_matches(buf))
 
-    for plen in range(max_prefixlen, 0, -1):
-        same_plen = sorted([n for n in nets if n.prefixlen == plen],
-                           key=lambda n: int(n.network_address))
+def build_containment_index(nets, maxlen):
+    """
+    Index same-family (net, plen) pairs for bisect containment tests:
+    (sorted range starts, running max of range ends). The running max
+    makes the lookup robust to nested prefixes.
+    """
+    ranges = sorted((net, net | ((1 << (maxlen - plen)) - 1))
+                    for net, plen in nets)
+    starts = [s for s, _ in ranges]
+    max_ends = []
+    running = -1
+    for _, end in ranges:
+        if end > running:
+            running = end
+        max_ends.append(running)
+    return starts, max_ends
+
+def covered_by(index, pair, maxlen):
+    """True if the (net, plen) pair lies inside some prefix in the index."""
+    starts, max_ends = index
+    net, plen = pair
+    i = bisect.bisect_right(starts, net) - 1
+    if i < 0:
+        return False
+    end = net | ((1 << (maxlen - plen)) - 1)
+    return max_ends[i] >= end
+
+def _is_lower_half(net, plen, maxlen):
+    """
+    True if the prefix is the lower half of its aligned enclosing
+    supernet. Equivalent to the old list(cand.subnets(prefixlen_diff=1))
+    == [a, b] guard, as a single bit test.
+    """
+    return net & (1 << (maxlen - plen)) == 0
+
+def _merge_levels(pairs, maxlen):
+    """
+    Merge same-size sibling pairs level by level, longest prefixes first:
+    two adjacent nets of one level whose union is an aligned supernet are
+    promoted to the next level, where they can merge again. Nested
+    prefixes simply stay put — unlike a one-pass stack merge they never
+    block a sibling merge, which keeps the result identical to the v1.1
+    per-prefix-length algorithm. Returns a list of (net, plen) pairs.
+    """
+    by_plen = defaultdict(set)
+    for net, plen in pairs:
+        by_plen[plen].add(net)
+    if not by_plen:
+        return []
+    result = []
+    for plen in range(max(by_plen), 0, -1):
+        group = by_plen.get(plen)
+        if not group:
+            continue
+        nets = sorted(group)
+        block = 1 << (maxlen - plen)
+        n = len(nets)
         i = 0
-        while i < len(same_plen) - 1:
-            a = same_plen[i]
-            b = same_plen[i + 1]
-            if are_adjacent(a, b):
-                try:
-                    cand = a.supernet(prefixlen_diff=1)
-                except ValueError:
-                    cand = None
-                if cand and list(cand.subnets(prefixlen_diff=1)) == [a, b]:
-                    nets.discard(a)
-                    nets.discard(b)
-                    nets.add(cand)
-                    i += 2
-                    continue
-            i += 1
-    return nets
+        while i < n:
+            a = nets[i]
+            if (i + 1 < n and nets[i + 1] == a + block
+                    and _is_lower_half(a, plen, maxlen)):
+                # promote the pair to its supernet; the set dedups a
+                # supernet that is already present
+                by_plen[plen - 1].add(a)
+                i += 2
+            else:
+                result.append((a, plen))
+                i += 1
+    result.extend((net, 0) for net in by_plen.get(0, ()))
+    return result
+
+def _merge_run_v4(pairs):
+    """Merge one IPv4 run; through the Numba kernel when available
+    (addresses fit in int64), otherwise the pure-Python level merge."""
+    if _merge_levels_v4 is not None and len(pairs) >= 2:
+        ordered = sorted(pairs, key=lambda t: (-t[1], t[0]))
+        count = len(ordered)
+        nets = np.fromiter((net for net, _ in ordered), dtype=np.int64, count=count)
+        plens = np.fromiter((plen for _, plen in ordered), dtype=np.int64, count=count)
+        out_net, out_plen = _merge_levels_v4(nets, plens)
+        return list(zip(out_net.tolist(), out_plen.tolist()))
+    return _merge_levels(pairs, 32)
+
+def _merge_run_v6(pairs):
+    """Merge one IPv6 run — 128-bit addresses stay on Python ints."""
+    return _merge_levels(pairs, 128)
+
+def _merge_buckets(pairs, maxlen, run):
+    """
+    Merge one family's pairs. Prefixes whose top address byte differs can
+    only merge at bucket boundaries, so the bulk of the work runs on small
+    per-/8 buckets (better cache residency) and one cheap pass over the
+    already-merged pieces picks up anything that straddles a boundary.
+    """
+    if not pairs:
+        return []
+    shift = maxlen - 8
+    buckets = defaultdict(list)
+    for pair in pairs:
+        buckets[pair[0] >> shift].append(pair)
+    if len(buckets) == 1:
+        return run(list(pairs))
+    pieces = []
+    for key in sorted(buckets):
+        pieces.extend(run(buckets[key]))
+    # prefixes at bucket boundaries may still merge across buckets
+    return run(pieces)
+
+def exact_merge_v4(pairs):
+    """Exact merge of adjacent same-size IPv4 subnets; see _merge_buckets."""
+    return _merge_buckets(pairs, 32, _merge_run_v4)
+
+def exact_merge_v6(pairs):
+    """Exact merge of adjacent same-size IPv6 subnets; see _merge_buckets."""
+    return _merge_buckets(pairs, 128, _merge_run_v6)
+
+def _changes_for_family(nets, maxlen, merge):
+    """Delete/set pairs for one address family of a prefix-list."""
+    original = set(nets)
+    final = merge(original)
+    final_set = set(final)
+    final_index = build_containment_index(final, maxlen)
+
+    # Safety check — no expansion (opt-in, see CHECK_INVARIANTS)
+    if CHECK_INVARIANTS:
+        assert all(covered_by(final_index, o, maxlen) for o in original), \
+            "ERROR: Summarization expanded IP coverage unexpectedly!"
+
+    to_delete = [o for o in original
+                 if o not in final_set and covered_by(final_index, o, maxlen)]
+
+    # A new final prefix is only emitted if it absorbed a deleted one:
+    # bisect into the sorted deleted starts instead of scanning them all.
+    del_starts = sorted(net for net, _plen in to_delete)
+    to_set = []
+    for f in final:
+        if f in original:
+            continue
+        f_net, f_plen = f
+        f_end = f_net | ((1 << (maxlen - f_plen)) - 1)
+        i = bisect.bisect_left(del_starts, f_net)
+        if i < len(del_starts) and del_starts[i] <= f_end:
+            to_set.append(f)
+    to_delete.sort()
+    to_set.sort()
+    return to_delete, to_set
 
 def generate_changes_for_pl(original_nets):
-    original = set(original_nets)
-    final = exact_merge(original)
+    """Changes for one prefix-list, given its (v4 pairs, v6 pairs) sets.
+    Returned lists hold (maxlen, net, plen) triples, IPv4 first."""
+    v4, v6 = original_nets
+    del4, set4 = _changes_for_family(v4, 32, exact_merge_v4) if v4 else ([], [])
+    del6, set6 = _changes_for_family(v6, 128, exact_merge_v6) if v6 else ([], [])
+    to_delete = ([(32, net, plen) for net, plen in del4]
+                 + [(128, net, plen) for net, plen in del6])
+    to_set = ([(32, net, plen) for net, plen in set4]
+              + [(128, net, plen) for net, plen in set6])
+    return to_delete, to_set, len(v4) + len(v6)
 
-    # Safety check — no expansion
-    assert all(any(o.subnet_of(f) for f in final) for o in original), \
-        "ERROR: Summarization expanded IP coverage unexpectedly!"
+def _changes_worker(item):
+    """Pool worker: (name, nets) -> (name, to_delete, to_set, orig_count)."""
+    name, nets = item
+    to_delete, to_set, orig_count = generate_changes_for_pl(nets)
+    return name, to_delete, to_set, orig_count
 
-    to_delete = [o for o in original if o not in final and any(o.subnet_of(f) for f in final)]
-    to_set = [f for f in final if f not in original and any(d.subnet_of(f) for d in to_delete)]
-    return to_delete, to_set, len(original)
+def compute_all_changes(prefix_lists):
+    """
+    Run generate_changes_for_pl for every prefix-list, in parallel when
+    there are enough lists to amortize the pool. Prefix-lists are
+    independent and the nets are plain int tuples, so they pickle cheaply.
+    Results come back sorted by name either way.
+    """
+    items = sorted(prefix_lists.items())
+    if len(items) < PARALLEL_MIN_LISTS:
+        return [_changes_worker(item) for item in items]
+    with multiprocessing.Pool() as pool:
+        chunksize = max(1, len(items) // (4 * (os.cpu_count() or 1)))
+        return sorted(pool.imap_unordered(_changes_worker, items, chunksize))
 
 def format_net(n):
-    return n.with_prefixlen
+    """Render a (maxlen, net, plen) triple as b'addr/plen'."""
+    maxlen, net, plen = n
+    if maxlen == 32:
+        # One C-level bytes format, no intermediate str
+        return b"%d.%d.%d.%d/%d" % (
+            net >> 24, (net >> 16) & 255, (net >> 8) & 255, net & 255, plen)
+    addr = socket.inet_ntop(socket.AF_INET6, net.to_bytes(16, 'big'))
+    return b"%s/%d" % (addr.encode('ascii'), plen)
 
 def main():
     t0 = time.time()
@@ -129,41 +480,53 @@ def main():
     if args:
         infile = args[0]
         try:
-            with open(infile, 'r') as fh:
-                lines = fh.readlines()
+            # Memory-map the file and scan it in place; fall back to
+            # streaming lines when it can't be mapped (e.g. empty file).
+            with open(infile, 'rb', buffering=1 << 20) as fh:
+                try:
+                    mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+                except (ValueError, OSError):
+                    prefix_lists, duplicates = parse_prefix_lists(fh)
+                else:
+                    with mm:
+                        prefix_lists, duplicates = parse_prefix_buffer(mm)
         except Exception as e:
             print(f"Error reading {infile}: {e}", file=sys.stderr)
             sys.exit(1)
         base = os.path.splitext(os.path.basename(infile))[0]
         out_filename = f"{base}_summarized_changes.conf"
     else:
-        lines = sys.stdin.read().splitlines()
+        prefix_lists, duplicates = parse_prefix_lists(sys.stdin.buffer)
         ts = int(time.time())
         out_filename = f"stdin_summarized_changes_{ts}.conf"
 
-    prefix_lists, duplicates = parse_prefix_lists(lines)
-
-    output_lines = []
     summary = {}
 
-    for name in sorted(prefix_lists.keys()):
-        original_nets = prefix_lists[name]
-        to_delete, to_set, orig_count = generate_changes_for_pl(original_nets)
-        if not to_delete and not to_set:
-            continue
-        for d in sorted(to_delete, key=lambda n: (int(n.network_address), n.prefixlen)):
-            output_lines.append(f"delete policy-options prefix-list {name} {format_net(d)}")
-        for s in sorted(to_set, key=lambda n: (int(n.network_address), n.prefixlen)):
-            output_lines.append(f"set policy-options prefix-list {name} {format_net(s)}")
-        summary[name] = (orig_count, len(to_delete), len(to_set), duplicates.get(name, 0))
-
-    if dry_run:
-        for ln in output_lines:
-            print(ln)
-    else:
-        with open(out_filename, 'w') as outf:
-            for ln in output_lines:
-                outf.write(ln + "\n")
+    # Stream changes straight to the destination — no output_lines buffer,
+    # and no re-sorting: generate_changes_for_pl returns sorted lists.
+    # Lines are assembled as bytes: the per-list command prefix is encoded
+    # once, not re-formatted per line.
+    outf = sys.stdout.buffer if dry_run else open(out_filename, 'wb', buffering=1 << 20)
+    try:
+        for name, to_delete, to_set, orig_count in compute_all_changes(prefix_lists):
+            if not to_delete and not to_set:
+                continue
+            name_b = name.encode('utf-8')
+            del_pfx = b"delete policy-options prefix-list %s " % name_b
+            set_pfx = b"set policy-options prefix-list %s " % name_b
+            # One write per prefix-list: join the lines once instead of
+            # crossing the buffered writer for every command.
+            lines = [del_pfx + format_net(d) for d in to_delete]
+            lines.extend(set_pfx + format_net(s) for s in to_set)
+            lines.append(b"")
+            outf.write(b"\n".join(lines))
+            summary[name] = (orig_count, len(to_delete), len(to_set), duplicates.get(name, 0))
+    finally:
+        if dry_run:
+            outf.flush()
+        else:
+            outf.close()
+    if not dry_run:
         print(f"Output written to: {out_filename}")
 
     t1 = time.time()
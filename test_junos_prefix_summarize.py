@@ -0,0 +1,97 @@
+"""
+Regression tests for the merge engine, in particular that nested prefixes
+never block a sibling merge (the v1.1 per-prefix-length behavior).
+
+Run with: python3 -m pytest test_junos_prefix_summarize.py
+"""
+import ipaddress
+import random
+
+import junos_prefix_summarize as jps
+
+
+def _v4(s):
+    """'a.b.c.d/p' -> (net, plen) pair."""
+    _maxlen, net, plen = jps.parse_prefix(s)
+    return net, plen
+
+
+def _v6(s):
+    _maxlen, net, plen = jps.parse_prefix(s)
+    return net, plen
+
+
+def _merge_reference(nets):
+    """The v1.0/v1.1 merge, verbatim, on ipaddress objects."""
+    nets = set(nets)
+    max_prefixlen = max((n.prefixlen for n in nets), default=0)
+    for plen in range(max_prefixlen, 0, -1):
+        same_plen = sorted([n for n in nets if n.prefixlen == plen],
+                           key=lambda n: int(n.network_address))
+        i = 0
+        while i < len(same_plen) - 1:
+            a = same_plen[i]
+            b = same_plen[i + 1]
+            if int(b.network_address) == int(a.network_address) + a.num_addresses:
+                cand = a.supernet(prefixlen_diff=1)
+                if list(cand.subnets(prefixlen_diff=1)) == [a, b]:
+                    nets.discard(a)
+                    nets.discard(b)
+                    nets.add(cand)
+                    i += 2
+                    continue
+            i += 1
+    return nets
+
+
+def test_nested_prefix_does_not_block_sibling_merge():
+    # 10.1.0.0/16 sorts between the two /9 halves of 10.0.0.0/8; it must
+    # not prevent them from merging.
+    pairs = {_v4("10.0.0.0/9"), _v4("10.128.0.0/9"), _v4("10.1.0.0/16")}
+    assert set(jps.exact_merge_v4(pairs)) == {_v4("10.0.0.0/8"), _v4("10.1.0.0/16")}
+
+
+def test_nested_prefix_does_not_block_sibling_merge_v6():
+    pairs = {_v6("2001:db8::/33"), _v6("2001:db8:8000::/33"), _v6("2001:db8:1::/48")}
+    assert set(jps.exact_merge_v6(pairs)) == {_v6("2001:db8::/32"), _v6("2001:db8:1::/48")}
+
+
+def test_merged_pair_dedups_against_present_supernet():
+    # The two /9s merge into a /8 that is already in the list.
+    pairs = {_v4("10.0.0.0/8"), _v4("10.0.0.0/9"), _v4("10.128.0.0/9")}
+    assert set(jps.exact_merge_v4(pairs)) == {_v4("10.0.0.0/8")}
+
+
+def test_merge_cascades_across_levels():
+    pairs = {(0x0A000000 + (i << 8), 24) for i in range(16)}
+    assert set(jps.exact_merge_v4(pairs)) == {_v4("10.0.0.0/20")}
+
+
+def test_lone_prefix_kept():
+    pairs = {_v4("192.168.1.0/25")}
+    assert set(jps.exact_merge_v4(pairs)) == pairs
+
+
+def test_generate_changes_for_nested_input():
+    v4 = {_v4("10.0.0.0/9"), _v4("10.128.0.0/9"), _v4("10.1.0.0/16")}
+    to_delete, to_set, orig_count = jps.generate_changes_for_pl((v4, set()))
+    assert orig_count == 3
+    # The /16 stays in the final set, so only the merged halves go.
+    assert to_delete == [(32,) + _v4("10.0.0.0/9"), (32,) + _v4("10.128.0.0/9")]
+    assert to_set == [(32,) + _v4("10.0.0.0/8")]
+
+
+def test_merge_matches_v11_reference_on_random_nested_input():
+    rng = random.Random(1234)
+    for _ in range(50):
+        pairs = set()
+        for _ in range(rng.randrange(1, 120)):
+            plen = rng.choice([7, 8, 9, 12, 16, 17, 24, 25, 26, 32])
+            net = rng.randrange(0, 1 << 10) << 22
+            net &= ~((1 << (32 - plen)) - 1)
+            pairs.add((net, plen))
+        expected = _merge_reference(
+            ipaddress.IPv4Network((net, plen)) for net, plen in pairs)
+        got = {ipaddress.IPv4Network((net, plen))
+               for net, plen in jps.exact_merge_v4(pairs)}
+        assert got == expected